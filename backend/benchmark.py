@@ -0,0 +1,339 @@
+"""Latency and throughput benchmark for the API.
+
+Runs a mixed shopper workload (browse, search, add-to-cart, checkout, login)
+against the app in-process through an ASGI transport, so no server has to be
+started. The in-memory DB is used unless ``--mongo-url`` is given, in which
+case a scratch database (``--db-name``) is dropped and reseeded first, or
+``--sqlite-path``, which benchmarks the shared SQLite store in a fresh file.
+
+    python benchmark.py                                  # defaults, print report
+    python benchmark.py --concurrency 50 --products 20000 --requests 20000
+    python benchmark.py --save-baseline                  # record benchmark_baseline.json
+    python benchmark.py --baseline                       # exit 1 on regression
+
+Where ``smoke_test.py`` and ``test_client_smoke.py`` walk the happy path
+once, this measures it: each virtual user registers its own account and
+loops over weighted scenarios until the request budget is spent. p50/p95
+latency, errors and throughput are gated against the baseline. Client and app share one event
+loop, so latencies include client overhead; compare runs on the same machine
+and settings only (the baseline stores them and refuses to compare otherwise).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+DEFAULT_BASELINE = Path(__file__).parent / "benchmark_baseline.json"
+
+CATEGORIES = ["Electronics", "Home", "Sports", "Books", "Toys", "Garden"]
+WORDS = [
+    "wireless", "smart", "portable", "premium", "classic", "compact", "ergonomic", "organic",
+    "steel", "bamboo", "leather", "cotton", "speaker", "watch", "lamp", "mat", "bottle", "shoes",
+    "stand", "kettle", "backpack", "charger", "blender", "jacket", "novel", "puzzle", "planter",
+]
+
+# Latencies checked against the baseline; p99 is reported but too noisy
+# over a few thousand requests to gate on
+GATED_PERCENTILES = ("p50_ms", "p95_ms")
+
+# Scenario name -> relative weight in the mix
+SCENARIOS = {
+    "browse": 50,
+    "search": 15,
+    "cart": 20,
+    "checkout": 5,
+    "login": 10,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users running at once")
+    parser.add_argument("--requests", type=int, default=5000, help="measured requests across all users")
+    parser.add_argument("--warmup", type=int, default=500, help="unmeasured requests run first")
+    parser.add_argument("--products", type=int, default=2000, help="generated products added to the catalog")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for data and workload")
+    parser.add_argument("--mongo-url", help="benchmark against this MongoDB instead of the in-memory DB")
+    parser.add_argument("--db-name", default="ecom_benchmark", help="scratch database used with --mongo-url")
+    parser.add_argument("--sqlite-path", help="benchmark the shared SQLite store in this (recreated) file")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", nargs="?", const=str(DEFAULT_BASELINE),
+                        help="compare against a stored baseline and exit 1 on regression")
+    parser.add_argument("--save-baseline", nargs="?", const=str(DEFAULT_BASELINE),
+                        help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown of gated latencies and throughput")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="ignore latency increases smaller than this (timer and scheduling noise)")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """Set the server's environment before it is imported."""
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+        os.environ["DB_NAME"] = args.db_name
+    else:
+        os.environ.pop("MONGO_URL", None)
+        os.environ.pop("SQLITE_PATH", None)
+        if args.sqlite_path:
+            for suffix in ("", "-wal", "-shm"):
+                Path(args.sqlite_path + suffix).unlink(missing_ok=True)
+            os.environ["SQLITE_PATH"] = args.sqlite_path
+        # Keep in-memory runs free of disk I/O from the write-ahead log
+        os.environ.pop("INMEMORY_DATA_DIR", None)
+    # Every login hashes a password; keep bcrypt's cost from dominating the run
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    # httpx logs each request at INFO, which would be measured too
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def make_products(count, rng):
+    products = []
+    for i in range(count):
+        words = rng.sample(WORDS, 3)
+        products.append({
+            "id": f"bench-{i:07d}",
+            "name": " ".join(words).title(),
+            "description": " ".join(rng.choices(WORDS, k=8)),
+            "price": round(rng.uniform(5, 500), 2),
+            "category": rng.choice(CATEGORIES),
+            "image": f"https://example.com/images/{i}.jpg",
+        })
+    return products
+
+
+class Recorder:
+    """Collects request latencies per endpoint."""
+
+    def __init__(self):
+        self.enabled = False
+        self.sent = 0
+        self.latencies = {}  # endpoint -> [seconds]
+        self.errors = {}  # endpoint -> count
+
+    async def call(self, client, method, endpoint, url, **kwargs):
+        self.sent += 1
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - start
+        if self.enabled:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if response.status_code >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return response
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class VirtualUser:
+    def __init__(self, index, client, recorder, catalog, rng):
+        self.client = client
+        self.recorder = recorder
+        self.catalog = catalog
+        self.rng = rng
+        self.email = f"bench-user-{index}@example.com"
+        self.password = f"bench-password-{index}"
+        self.headers = {}
+
+    async def call(self, method, endpoint, url, **kwargs):
+        return await self.recorder.call(self.client, method, endpoint, url, headers=self.headers, **kwargs)
+
+    async def register(self):
+        response = await self.client.post("/api/auth/register", json={
+            "email": self.email, "password": self.password, "name": "Bench User",
+        })
+        if response.status_code == 400:
+            # Left over from an earlier run against the same database
+            response = await self.client.post("/api/auth/login", json={"email": self.email, "password": self.password})
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def browse(self):
+        kind = self.rng.random()
+        if kind < 0.2:
+            await self.call("GET", "GET /products", "/api/products")
+        elif kind < 0.6:
+            params = {"category": self.rng.choice(CATEGORIES), "sort": self.rng.choice(["name", "price"]), "limit": 24}
+            response = await self.call("GET", "GET /products?page", "/api/products", params=params)
+            cursor = response.headers.get("x-next-cursor")
+            if cursor and self.rng.random() < 0.5:
+                params["cursor"] = cursor
+                await self.call("GET", "GET /products?page", "/api/products", params=params)
+        else:
+            product = self.rng.choice(self.catalog)
+            await self.call("GET", "GET /products/{id}", f"/api/products/{product['id']}")
+
+    async def search(self):
+        product = self.rng.choice(self.catalog)
+        word = product["name"].split()[0].lower()
+        await self.call("GET", "GET /products/autocomplete", "/api/products/autocomplete", params={"q": word[:3]})
+        await self.call("GET", "GET /products/search", "/api/products/search", params={"q": word})
+
+    async def cart(self):
+        product = self.rng.choice(self.catalog)
+        await self.call("POST", "POST /cart", "/api/cart", json={"product_id": product["id"], "quantity": self.rng.randint(1, 3)})
+        response = await self.call("GET", "GET /cart", "/api/cart")
+        items = response.json()["items"]
+        if len(items) > 5:
+            # Keep carts at a realistic size
+            await self.call("DELETE", "DELETE /cart/{id}", f"/api/cart/{items[0]['id']}")
+        await self.call("GET", "GET /cart/summary", "/api/cart/summary")
+
+    async def checkout(self):
+        product = self.rng.choice(self.catalog)
+        await self.call("POST", "POST /cart", "/api/cart", json={"product_id": product["id"], "quantity": 1})
+        await self.call("POST", "POST /checkout", "/api/checkout", json={"name": "Bench User", "email": self.email})
+        await self.call("GET", "GET /orders", "/api/orders", params={"limit": 10})
+
+    async def login(self):
+        await self.call("POST", "POST /auth/login", "/api/auth/login", json={"email": self.email, "password": self.password})
+
+
+async def drive(users, recorder, budget):
+    """Run every user's scenario loop until ``budget`` requests have been sent."""
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name] for name in names]
+    recorder.sent = 0
+
+    async def user_loop(user):
+        while recorder.sent < budget:
+            scenario = user.rng.choices(names, weights)[0]
+            await getattr(user, scenario)()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop(user) for user in users))
+    return time.perf_counter() - start
+
+
+async def run(args):
+    import httpx
+    import server
+
+    rng = random.Random(args.seed)
+    if server.client is not None:
+        await server.client.drop_database(args.db_name)
+    await server.startup_event()
+    if args.products:
+        await server.db.products.insert_many(make_products(args.products, rng))
+        await server.products_changed()
+    catalog = await server.db.products.find({}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            users = [
+                VirtualUser(i, client, recorder, catalog, random.Random(args.seed * 1000 + i))
+                for i in range(args.concurrency)
+            ]
+            await asyncio.gather(*(user.register() for user in users))
+            # Warm caches and views first, unmeasured
+            await drive(users, recorder, args.warmup)
+            recorder.enabled = True
+            elapsed = await drive(users, recorder, args.requests)
+    finally:
+        await server.shutdown_db_client()
+
+    return build_report(args, recorder, elapsed)
+
+
+def build_report(args, recorder, elapsed):
+    endpoints = {}
+    total = 0
+    for endpoint, values in sorted(recorder.latencies.items()):
+        values.sort()
+        total += len(values)
+        endpoints[endpoint] = {
+            "count": len(values),
+            "errors": recorder.errors.get(endpoint, 0),
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    return {
+        "settings": {
+            "backend": "mongo" if args.mongo_url else "sqlite" if args.sqlite_path else "memory",
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "products": args.products,
+            "seed": args.seed,
+            # Cart views change the cost of every cart route
+            "cart_views": sys.modules["server"].CART_VIEW_ENABLED,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "total_requests": total,
+        "rps": round(total / elapsed, 1),
+        "endpoints": endpoints,
+    }
+
+
+def print_report(report):
+    settings = report["settings"]
+    print(f"\nbackend={settings['backend']} concurrency={settings['concurrency']} "
+          f"products=+{settings['products']} requests={report['total_requests']} "
+          f"in {report['elapsed_s']}s ({report['rps']} req/s)\n")
+    print(f"{'endpoint':<28}{'count':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"{endpoint:<28}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def compare(report, baseline, tolerance, min_delta_ms):
+    """Return a list of regressions of ``report`` against ``baseline``."""
+    if report["settings"] != baseline["settings"]:
+        return [f"settings differ from the baseline: {baseline['settings']}"]
+    problems = []
+    limit = 1 + tolerance
+    if report["rps"] < baseline["rps"] / limit:
+        problems.append(f"throughput {report['rps']} req/s < baseline {baseline['rps']} req/s")
+    for endpoint, base in baseline["endpoints"].items():
+        current = report["endpoints"].get(endpoint)
+        if current is None:
+            problems.append(f"{endpoint}: not exercised in this run")
+            continue
+        if current["errors"] > base["errors"]:
+            problems.append(f"{endpoint}: {current['errors']} errors (baseline {base['errors']})")
+        for key in GATED_PERCENTILES:
+            if current[key] > base[key] * limit and current[key] - base[key] > min_delta_ms:
+                problems.append(f"{endpoint}: {key} {current[key]} > baseline {base[key]}")
+    return problems
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nSaved baseline to {args.save_baseline}")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        problems = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        if problems:
+            print(f"\nRegressions against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for problem in problems:
+                print(f"  {problem}")
+            return 1
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Bulk catalog import and export from the command line.
+
+Uses the same streaming import/export code as the /api/admin routes, talking
+to whatever store the environment selects (MONGO_URL, SQLITE_PATH, or the
+in-memory DB persisted under INMEMORY_DATA_DIR):
+
+    python catalog_cli.py import products.ndjson
+    python catalog_cli.py import products.csv --mode insert
+    python catalog_cli.py export products --format csv -o products.csv
+    python catalog_cli.py export orders > orders.ndjson
+
+Workers sharing SQLITE_PATH pick up an import on their next catalog read,
+servers on Mongo within CATALOG_VERSION_POLL_INTERVAL seconds.
+
+An in-memory server must be stopped first: it owns INMEMORY_DATA_DIR while
+it runs (the CLI exits with an error otherwise) and would never see the
+import. Start it again afterwards to load the new snapshot.
+"""
+import argparse
+import asyncio
+import sys
+
+try:
+    import server
+except RuntimeError as exc:
+    # DataDirLocked: a running server holds INMEMORY_DATA_DIR
+    sys.exit(f"catalog_cli: {exc}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("import", help="import products from an NDJSON or CSV file")
+    load.add_argument("path")
+    load.add_argument("--format", choices=["ndjson", "csv"], help="defaults to the file extension")
+    load.add_argument("--mode", choices=["upsert", "insert"], default="upsert",
+                      help="replace products whose id exists, or skip them")
+
+    dump = commands.add_parser("export", help="export products or orders")
+    dump.add_argument("collection", choices=["products", "orders"])
+    dump.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    dump.add_argument("-o", "--output", help="file to write (default: stdout)")
+    return parser.parse_args(argv)
+
+
+async def read_chunks(path, size=1 << 20):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def run_import(args):
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    lines = server.iter_lines(read_chunks(args.path))
+    rows = server.iter_csv_rows(lines) if fmt == "csv" else server.iter_ndjson_rows(lines)
+    result = await server.import_products(rows, args.mode)
+    if result["inserted"] or result["updated"]:
+        # Tell running workers to refresh their catalog caches
+        await server.bump_catalog_version()
+    print(f"inserted={result['inserted']} updated={result['updated']} "
+          f"skipped={result['skipped']} invalid={result['invalid']}", file=sys.stderr)
+    for error in result["errors"]:
+        print(f"  line {error['line']}: {error['detail']}", file=sys.stderr)
+    return 0 if not result["invalid"] else 2
+
+
+async def run_export(args):
+    if args.collection == "orders" and args.format == "csv":
+        print("orders can only be exported as ndjson", file=sys.stderr)
+        return 1
+    collection = server.db.products if args.collection == "products" else server.db.orders
+    docs = server.iter_documents(collection, {"_id": 0})
+    body = server.export_csv(docs, server.PRODUCT_CSV_FIELDS) if args.format == "csv" else server.export_ndjson(docs)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for chunk in body:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    if server.client is None and server.shared_store is None and server.durable_store is None:
+        print("No persistent store configured: set MONGO_URL, SQLITE_PATH or INMEMORY_DATA_DIR "
+              "(or use the /api/admin routes of a running server)", file=sys.stderr)
+        return 1
+    if server.client is not None:
+        await server.ensure_mongo_indexes()
+    try:
+        if args.command == "import":
+            return await run_import(args)
+        return await run_export(args)
+    finally:
+        # Closes the client, and snapshots an in-memory store so the next
+        # server start loads the import in bulk
+        await server.shutdown_db_client()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
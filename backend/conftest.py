@@ -0,0 +1,60 @@
+"""Shared fixtures: the app running on a freshly imported store.
+
+Most of the server's state (store, caches, views, search index) is module
+level and chosen from the environment at import, so each test that needs
+the whole app reloads ``server`` under its own environment and reloads it
+again afterwards, leaving the default in-memory setup for the next test.
+"""
+import contextlib
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+# Settings that would point the app at an outside store or data directory
+STORE_ENV = ("MONGO_URL", "SQLITE_PATH", "INMEMORY_DATA_DIR", "INMEMORY_COMPACT", "CART_VIEW_ENABLED")
+
+ADMIN_EMAIL = "admin@example.com"
+
+
+@contextlib.contextmanager
+def running_app(backend, tmp_path, before_start=None, **env):
+    """Yield a TestClient for the app on ``backend`` ("memory" or "sqlite").
+
+    ``before_start`` is called with the freshly imported module before the
+    app starts up, to patch what startup runs.
+    """
+    with pytest.MonkeyPatch.context() as patch:
+        for name in STORE_ENV:
+            patch.delenv(name, raising=False)
+        if backend == "sqlite":
+            patch.setenv("SQLITE_PATH", str(tmp_path / "shop.sqlite"))
+        patch.setenv("ADMIN_EMAILS", ADMIN_EMAIL)
+        patch.setenv("BCRYPT_ROUNDS", "4")
+        for name, value in env.items():
+            patch.setenv(name, value)
+        importlib.reload(server)
+        try:
+            if before_start is not None:
+                before_start(server)
+            with TestClient(server.app) as client:
+                yield client
+        finally:
+            patch.undo()
+            importlib.reload(server)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def api(request, tmp_path):
+    with running_app(request.param, tmp_path) as client:
+        yield client
+
+
+def admin_headers(client) -> dict:
+    """Register the admin account and return its bearer header."""
+    response = client.post("/api/auth/register",
+                           json={"email": ADMIN_EMAIL, "password": "admin-pass", "name": "Admin"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
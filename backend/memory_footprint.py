@@ -0,0 +1,95 @@
+"""Memory per stored row of the in-memory DB, plain vs ``INMEMORY_COMPACT``.
+
+Inserts generated cart lines and orders into a fresh ``InMemoryDB`` in each
+mode and reports what tracemalloc sees the store keep per row, indexes
+included. Every document is decoded from its own JSON text, as request
+bodies are, so no strings are shared with the generator.
+
+    python memory_footprint.py                       # 50k rows, 5k users
+    python memory_footprint.py --rows 200000 --users 20000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=50000, help="rows inserted per collection")
+    parser.add_argument("--users", type=int, default=5000, help="distinct users owning the rows")
+    parser.add_argument("--products", type=int, default=20, help="distinct products in carts and orders")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the generated rows")
+    return parser.parse_args(argv)
+
+
+def make_rows(args, rng):
+    """JSON text of ``args.rows`` cart lines and orders."""
+    users = [(str(uuid.UUID(int=rng.getrandbits(128))), f"Customer {i}", f"customer{i}@example.com")
+             for i in range(args.users)]
+    products = [(str(uuid.UUID(int=rng.getrandbits(128))), f"Product {i}", round(rng.uniform(5, 200), 2))
+                for i in range(args.products)]
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def created_at():
+        return (start + timedelta(seconds=rng.randrange(365 * 86400), microseconds=rng.randrange(10 ** 6))).isoformat()
+
+    carts, orders = [], []
+    for _ in range(args.rows):
+        user_id, name, email = rng.choice(users)
+        carts.append(json.dumps({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))), "user_id": user_id,
+            "product_id": rng.choice(products)[0], "quantity": rng.randint(1, 5), "created_at": created_at(),
+        }))
+        items = [{"product_id": pid, "product_name": pname, "quantity": rng.randint(1, 3), "price": price}
+                 for pid, pname, price in rng.sample(products, rng.randint(1, 4))]
+        orders.append(json.dumps({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))), "user_id": user_id, "items": items,
+            "total": round(sum(item["price"] * item["quantity"] for item in items), 2),
+            "customer_name": name, "customer_email": email,
+            "item_count": sum(item["quantity"] for item in items), "created_at": created_at(),
+        }))
+    return {"cart_items": carts, "orders": orders}
+
+
+async def bytes_per_row(server, compact, collection, rows):
+    db = server.InMemoryDB(compact=compact)
+    target = getattr(db, collection)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for text in rows:
+        await target.insert_one(json.loads(text))
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / len(rows)
+
+
+async def run(args):
+    # The store is created here; keep the server from opening another one
+    for name in ("MONGO_URL", "SQLITE_PATH", "INMEMORY_DATA_DIR"):
+        os.environ.pop(name, None)
+    import server
+
+    rows = make_rows(args, random.Random(args.seed))
+    print(f"{args.rows} rows per collection, {args.users} users, {args.products} products")
+    print(f"{'collection':<12} {'plain B/row':>12} {'compact B/row':>14} {'ratio':>7}")
+    for collection, texts in rows.items():
+        plain = await bytes_per_row(server, False, collection, texts)
+        compact = await bytes_per_row(server, True, collection, texts)
+        print(f"{collection:<12} {plain:>12.0f} {compact:>14.0f} {plain / compact:>6.1f}x")
+
+
+def main(argv=None):
+    asyncio.run(run(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
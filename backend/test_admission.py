@@ -0,0 +1,102 @@
+"""Tests for per-route admission control (AdmissionGate / AdmissionController)."""
+import asyncio
+
+import pytest
+
+import server
+
+
+def test_gate_hands_slots_to_waiters_in_order():
+    async def run():
+        gate = server.AdmissionGate(1, queue=4)
+        assert await gate.acquire(1) is False
+        order = []
+
+        async def request(name):
+            await gate.acquire(1)
+            order.append(name)
+
+        tasks = [asyncio.create_task(request(name)) for name in "abc"]
+        await asyncio.sleep(0)
+        assert len(gate.waiters) == 3
+        for _ in range(3):
+            gate.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        gate.release()
+        assert order == ["a", "b", "c"] and gate.active == 0
+
+    asyncio.run(run())
+
+
+def test_gate_rejects_when_queue_full_or_wait_too_long():
+    async def run():
+        gate = server.AdmissionGate(1, queue=1)
+        await gate.acquire(1)
+        waiting = asyncio.create_task(gate.acquire(0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(server.AdmissionRejected) as full:
+            await gate.acquire(1)
+        assert full.value.reason == "queue_full"
+        with pytest.raises(server.AdmissionRejected) as timeout:
+            await waiting
+        assert timeout.value.reason == "queue_timeout"
+        assert not gate.waiters
+        gate.release()
+        assert gate.active == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_leak_a_handed_over_slot():
+    async def run():
+        gate = server.AdmissionGate(1, queue=2)
+        await gate.acquire(1)
+        waiting = asyncio.create_task(gate.acquire(1))
+        await asyncio.sleep(0)
+        # The holder finishes and hands its slot over, then the waiting
+        # request is cancelled (client disconnect) before it resumes
+        gate.release()
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert gate.active == 0 and not gate.waiters
+        assert await gate.acquire(0.05) is False
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        gate = server.AdmissionGate(1, queue=2)
+        await gate.acquire(1)
+        waiting = asyncio.create_task(gate.acquire(1))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert not gate.waiters
+        gate.release()
+        assert gate.active == 0
+
+    asyncio.run(run())
+
+
+def test_controller_sheds_lower_priorities_first():
+    async def run():
+        controller = server.AdmissionController(max_in_flight=4)
+        gate = server.AdmissionGate(None, queue=0)
+        for _ in range(2):
+            await controller.admit(gate, "/r", "critical")
+        with pytest.raises(server.AdmissionRejected) as shed:
+            await controller.admit(gate, "/r", "heavy")
+        assert shed.value.reason == "shed"
+        await controller.admit(gate, "/r", "standard")
+        await controller.admit(gate, "/r", "critical")
+        with pytest.raises(server.AdmissionRejected):
+            await controller.admit(gate, "/r", "critical")
+        for priority in ("critical", "critical", "standard", "critical"):
+            controller.done(gate, priority)
+        assert controller.in_flight == 0
+
+    asyncio.run(run())
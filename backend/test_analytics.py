@@ -0,0 +1,34 @@
+"""Tests for the sales analytics route and its lazy NumPy import."""
+import sys
+
+import server
+from conftest import admin_headers, running_app
+
+
+def place_order(client, quantity=2):
+    product = client.get("/api/products").json()[0]
+    client.post("/api/cart", json={"product_id": product["id"], "quantity": quantity})
+    response = client.post("/api/checkout", json={"name": "Tester", "email": "tester@example.com"})
+    assert response.status_code == 200, response.text
+    return product
+
+
+def test_numpy_is_imported_by_the_first_report(tmp_path):
+    with running_app("memory", tmp_path) as client:
+        assert server.np is None
+        product = place_order(client)
+        response = client.get("/api/admin/analytics", headers=admin_headers(client))
+        assert response.status_code == 200, response.text
+        assert server.np is not None
+        report = response.json()
+        assert (report["orders"], report["units"]) == (1, 2)
+        assert report["revenue"] == round(product["price"] * 2, 2)
+        assert [p["product_id"] for p in report["top_products"]] == [product["id"]]
+
+
+def test_report_unavailable_without_numpy(tmp_path, monkeypatch):
+    with running_app("memory", tmp_path) as client:
+        monkeypatch.setitem(sys.modules, "numpy", None)
+        response = client.get("/api/admin/analytics", headers=admin_headers(client))
+        assert response.status_code == 503
+        assert response.json()["detail"] == "Sales analytics requires numpy"
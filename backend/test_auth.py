@@ -0,0 +1,132 @@
+"""Tests for auth: the password hashing pool (PasswordHasher) and the
+verified-token cache (TokenCache)."""
+import threading
+import time
+
+import server
+from conftest import running_app
+
+
+def register(client, email="shopper@example.com"):
+    response = client.post("/api/auth/register", json={
+        "email": email, "password": "secret-pass", "name": "Shopper"})
+    assert response.status_code == 200, response.text
+    token = response.json()
+    return token["user"]["id"], {"Authorization": f"Bearer {token['access_token']}"}
+
+
+def rename(client, user_id, name):
+    client.portal.call(server.db.users.update_one, {"id": user_id}, {"$set": {"name": name}})
+
+
+def held_hashes(monkeypatch):
+    """Make password hashing block until the returned event is set."""
+    release = threading.Event()
+    hash_password = server.hash_password
+
+    def slow_hash(password):
+        release.wait(10)
+        return hash_password(password)
+
+    monkeypatch.setattr(server, "hash_password", slow_hash)
+    return release
+
+
+def wait_for_pending(count):
+    deadline = time.monotonic() + 5
+    while server.password_hasher.pending != count:
+        assert time.monotonic() < deadline, server.password_hasher.pending
+        time.sleep(0.01)
+
+
+def assert_unavailable(response, detail):
+    assert response.status_code == 503, response.text
+    assert response.json()["detail"] == detail
+    assert response.headers["retry-after"] == "1"
+
+
+def test_hashing_beyond_max_pending_gets_503(tmp_path, monkeypatch):
+    with running_app("memory", tmp_path, PASSWORD_HASH_MAX_PENDING="1") as client:
+        release = held_hashes(monkeypatch)
+        first = []
+        waiting = threading.Thread(target=lambda: first.append(register(client, "first@example.com")))
+        waiting.start()
+        try:
+            wait_for_pending(1)
+            response = client.post("/api/auth/register", json={
+                "email": "second@example.com", "password": "secret-pass", "name": "Shopper"})
+            assert_unavailable(response, "Authentication service busy")
+        finally:
+            release.set()
+            waiting.join()
+        assert first and server.password_hasher.pending == 0
+        register(client, "second@example.com")
+
+
+def test_slow_hashing_times_out_with_503(tmp_path, monkeypatch):
+    with running_app("memory", tmp_path, PASSWORD_HASH_TIMEOUT="0.2") as client:
+        release = held_hashes(monkeypatch)
+        try:
+            response = client.post("/api/auth/register", json={
+                "email": "slow@example.com", "password": "secret-pass", "name": "Shopper"})
+            assert_unavailable(response, "Authentication timed out")
+            # The abandoned hash keeps its slot until it really finishes
+            assert server.password_hasher.pending == 1
+        finally:
+            release.set()
+        wait_for_pending(0)
+        assert client.post("/api/auth/login", json={
+            "email": "slow@example.com", "password": "secret-pass"}).status_code == 401
+
+
+def test_cached_tokens_skip_verification(api, monkeypatch):
+    _, headers = register(api)
+    assert api.get("/api/auth/me", headers=headers).json()["name"] == "Shopper"
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("a cached token was decoded again")
+
+    monkeypatch.setattr(server.jwt, "decode", no_decode)
+    assert api.get("/api/auth/me", headers=headers).json()["name"] == "Shopper"
+
+
+def test_invalidating_a_user_rereads_it(api):
+    user_id, headers = register(api)
+    api.get("/api/auth/me", headers=headers)
+    rename(api, user_id, "Renamed")
+    # The cached copy is served until the user is invalidated
+    assert api.get("/api/auth/me", headers=headers).json()["name"] == "Shopper"
+    server.invalidate_user(user_id)
+    assert api.get("/api/auth/me", headers=headers).json()["name"] == "Renamed"
+
+    demo = api.get("/api/auth/me").json()
+    rename(api, demo["id"], "Renamed Demo")
+    server.invalidate_user(demo["id"])
+    assert api.get("/api/auth/me").json()["name"] == "Renamed Demo"
+
+
+def test_entries_expire_with_the_ttl_or_the_token(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "time", lambda: now[0])
+    cache = server.TokenCache(max_size=10, ttl=60)
+    user = {"id": "u1"}
+    cache.put("ttl-bound", user, exp=None)
+    cache.put("exp-bound", user, exp=now[0] + 5)
+    assert cache.get("ttl-bound") is user and cache.get("exp-bound") is user
+
+    now[0] += 6
+    assert cache.get("exp-bound") is None and cache.get("ttl-bound") is user
+    now[0] += 55
+    assert cache.get("ttl-bound") is None
+    assert cache._tokens_by_user == {}
+
+
+def test_cache_evicts_the_least_recently_used_token():
+    cache = server.TokenCache(max_size=2, ttl=60)
+    for token, user_id in (("a", "u1"), ("b", "u2")):
+        cache.put(token, {"id": user_id}, exp=None)
+    cache.get("a")
+    cache.put("c", {"id": "u1"}, exp=None)
+    assert cache.get("b") is None and cache.get("a") is not None
+    cache.invalidate_user("u1")
+    assert cache.get("a") is None and cache.get("c") is None
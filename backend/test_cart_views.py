@@ -0,0 +1,66 @@
+"""Tests for the per-user cart views (CartView / CartViews)."""
+import pytest
+
+import server
+from conftest import running_app
+
+
+@pytest.mark.parametrize("backend, enabled", [("memory", True), ("sqlite", False)])
+def test_views_default_on_only_for_the_in_memory_db(backend, enabled, tmp_path):
+    with running_app(backend, tmp_path):
+        # The default must not depend on the metrics wrapper around the store
+        assert isinstance(server.db, server.InstrumentedDB) == server.METRICS_ENABLED
+        assert server.CART_VIEW_ENABLED is enabled
+
+
+def cart_after_rebuild(client):
+    server.cart_views.invalidate_products()
+    return client.get("/api/cart").json()
+
+
+def test_view_follows_cart_writes(tmp_path):
+    with running_app("memory", tmp_path) as client:
+        first, second = [p["id"] for p in client.get("/api/products").json()[:2]]
+        line = client.post("/api/cart", json={"product_id": first, "quantity": 2}).json()["cart_item_id"]
+        client.post("/api/cart", json={"product_id": first, "quantity": 1})
+        other = client.post("/api/cart", json={"product_id": second}).json()["cart_item_id"]
+        client.patch(f"/api/cart/{other}", json={"quantity": 4})
+
+        cart = client.get("/api/cart").json()
+        assert {item["id"]: item["quantity"] for item in cart["items"]} == {line: 3, other: 4}
+        assert cart == cart_after_rebuild(client)
+
+        batch = client.post("/api/cart/batch", json={"operations": [
+            {"op": "remove", "cart_item_id": line},
+            {"op": "update", "cart_item_id": other, "quantity": 1},
+            {"op": "add", "product_id": "missing"},
+        ]}).json()
+        assert [result["status"] for result in batch["results"]] == [200, 200, 404]
+        assert batch["cart"] == client.get("/api/cart").json() == cart_after_rebuild(client)
+        summary = client.get("/api/cart/summary").json()
+        assert summary == {"total": batch["cart"]["total"], "item_count": 1}
+
+
+@pytest.mark.parametrize("backend, env", [("sqlite", {}), ("memory", {"CART_VIEW_ENABLED": "0"})])
+def test_checkout_keeps_no_views_when_disabled(backend, env, tmp_path):
+    with running_app(backend, tmp_path, **env) as client:
+        assert not server.CART_VIEW_ENABLED
+        product_id = client.get("/api/products").json()[0]["id"]
+        for i in range(3):
+            token = client.post("/api/auth/register", json={
+                "email": f"shopper{i}@example.com", "password": "secret-pass", "name": "Shopper"}).json()
+            headers = {"Authorization": f"Bearer {token['access_token']}"}
+            client.post("/api/cart", json={"product_id": product_id}, headers=headers)
+            response = client.post("/api/checkout", headers=headers,
+                                   json={"name": "Shopper", "email": f"shopper{i}@example.com"})
+            assert response.status_code == 200, response.text
+            assert client.get("/api/cart", headers=headers).json() == {"items": [], "total": 0.0}
+        assert len(server.cart_views._views) == 0
+
+
+def test_cleared_carts_respect_the_lru_bound():
+    views = server.CartViews(max_users=2)
+    for user_id in ("a", "b", "c"):
+        views.on_cart_cleared(user_id)
+    views.on_cart_cleared("b")
+    assert list(views._views) == ["c", "b"]
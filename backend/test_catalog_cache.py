@@ -0,0 +1,50 @@
+"""Tests for the catalog cache (CatalogCache) and its ETag / 304 handling."""
+import json
+
+from conftest import admin_headers
+
+# Keep compression out of these: encoded bodies carry their own validators
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+def get(client, url, etag=None):
+    headers = dict(IDENTITY)
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    return client.get(url, headers=headers)
+
+
+def test_matching_etag_gets_304(api):
+    first = get(api, "/api/products")
+    etag = first.headers["etag"]
+    product_url = f"/api/products/{first.json()[0]['id']}"
+    product_etag = get(api, product_url).headers["etag"]
+    for url, tag in (("/api/products", etag), (product_url, product_etag)):
+        for header in (tag, f"W/{tag}", f'"stale", {tag}', "*"):
+            response = get(api, url, header)
+            assert response.status_code == 304, header
+            assert response.content == b"" and response.headers["etag"] == tag
+        assert get(api, url, '"stale"').status_code == 200
+    # Cached bodies are served as built: repeated reads are byte-identical
+    assert get(api, "/api/products").content == first.content
+
+
+def test_import_invalidates_cached_pages(api):
+    before = get(api, "/api/products")
+    product = before.json()[0]
+    product_url = f"/api/products/{product['id']}"
+    product_etag = get(api, product_url).headers["etag"]
+
+    renamed = dict(product, name="Aaa Renamed")
+    added = {"id": "imported-1", "name": "Aab New", "description": "d", "price": 1.5,
+             "category": "Home", "image": "https://example.com/1.jpg"}
+    body = "\n".join(json.dumps(doc) for doc in (renamed, added)) + "\n"
+    response = api.post("/api/admin/products/import", content=body, headers=admin_headers(api))
+    assert response.json()["inserted"] == 1 and response.json()["updated"] == 1
+
+    after = get(api, "/api/products", before.headers["etag"])
+    assert after.status_code == 200 and after.headers["etag"] != before.headers["etag"]
+    assert [p["name"] for p in after.json()[:2]] == ["Aaa Renamed", "Aab New"]
+    changed = get(api, product_url, product_etag)
+    assert changed.status_code == 200 and changed.json()["name"] == "Aaa Renamed"
+    assert get(api, "/api/products/imported-1").json()["price"] == 1.5
@@ -0,0 +1,67 @@
+"""Tests for response compression: precompressed catalog payloads
+(CachedPayload.encoded) and CompressionMiddleware."""
+import pytest
+
+import server
+from conftest import admin_headers, running_app
+
+
+@pytest.fixture
+def client(tmp_path):
+    # Low enough that the seeded catalog still exceeds it once compressed, so
+    # the middleware must recognize precompressed bodies rather than skip them
+    with running_app("memory", tmp_path, COMPRESSION_MIN_SIZE="512") as client:
+        yield client
+
+
+def get(client, url, encoding, etag=None, **headers):
+    headers["Accept-Encoding"] = encoding
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    return client.get(url, headers=headers)
+
+
+@pytest.mark.parametrize("encoding", server.SUPPORTED_ENCODINGS)
+def test_catalog_has_an_etag_per_encoding(client, encoding):
+    plain = get(client, "/api/products", "identity")
+    encoded = get(client, "/api/products", encoding)
+    assert len(plain.content) >= server.COMPRESSION_MIN_SIZE
+    assert int(encoded.headers["content-length"]) >= server.COMPRESSION_MIN_SIZE
+    assert "content-encoding" not in plain.headers
+    assert encoded.headers["content-encoding"] == encoding
+    for response in (plain, encoded):
+        assert response.headers["vary"] == "Accept-Encoding"
+    assert encoded.headers["etag"] == plain.headers["etag"][:-1] + f'-{encoding}"'
+    # Decoded once by the client: not compressed twice by the middleware
+    assert encoded.content == plain.content
+
+    # Either validator is current for a client asking for this encoding
+    for etag in (encoded.headers["etag"], plain.headers["etag"]):
+        not_modified = get(client, "/api/products", encoding, etag)
+        assert not_modified.status_code == 304
+        assert not_modified.headers["etag"] == encoded.headers["etag"]
+    # An identity client must not get a 304 for a compressed copy
+    assert get(client, "/api/products", "identity", encoded.headers["etag"]).status_code == 200
+
+
+def test_small_and_unaccepted_bodies_pass_through(client):
+    product_id = get(client, "/api/products", "identity").json()[0]["id"]
+    small = get(client, f"/api/products/{product_id}", "gzip")
+    assert len(small.content) < server.COMPRESSION_MIN_SIZE
+    assert "content-encoding" not in small.headers
+    assert "vary" not in small.headers
+    unaccepted = get(client, "/api/products?sort=price", "compress, gzip;q=0")
+    assert "content-encoding" not in unaccepted.headers
+
+
+def test_middleware_compresses_dynamic_and_streamed_bodies(client):
+    plain = get(client, "/api/products?sort=-price", "identity")
+    encoded = get(client, "/api/products?sort=-price", "gzip")
+    assert encoded.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in encoded.headers["vary"]
+    assert encoded.content == plain.content
+
+    headers = admin_headers(client)
+    export = get(client, "/api/admin/products/export", "gzip", **headers)
+    assert export.headers["content-encoding"] == "gzip"
+    assert len(export.text.splitlines()) == len(plain.json())
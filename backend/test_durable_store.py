@@ -0,0 +1,124 @@
+"""Recovery tests for the in-memory DB's WAL and snapshots (DurableStore)."""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import server
+
+
+def open_store(path, snapshot_interval=0):
+    store = server.DurableStore(server.InMemoryDB(), str(path), commit_interval=0.001,
+                                snapshot_interval=snapshot_interval)
+    store.recover()
+    return store
+
+
+def crash(store):
+    """Stop without a final snapshot, releasing the data dir as process exit would."""
+    store.wal.close()
+    store.unlock()
+
+
+async def user_ids(db):
+    return [u["id"] for u in await db.users.find({}, {"_id": 0}).sort([("id", 1)]).to_list(None)]
+
+
+def test_recovery_replays_wal_and_snapshot(tmp_path):
+    async def run():
+        store = open_store(tmp_path)
+        await store.db.users.insert_one({"id": "u1", "email": "a@x.io"})
+        await store.snapshot()
+        await store.db.users.insert_one({"id": "u2", "email": "b@x.io"})
+        await store.db.users.update_one({"id": "u1"}, {"$set": {"email": "c@x.io"}})
+        await store.db.users.delete_one({"id": "u2"})
+        await store.db.users.insert_one({"id": "u3", "email": "d@x.io"})
+        await store.wal.flush()
+        crash(store)
+
+        recovered = open_store(tmp_path)
+        assert await user_ids(recovered.db) == ["u1", "u3"]
+        assert (await recovered.db.users.find_one({"id": "u1"}, {"_id": 0}))["email"] == "c@x.io"
+        # Row ids keep increasing after recovery
+        await recovered.db.users.insert_one({"id": "u4"})
+        assert list(recovered.db.users.items) == sorted(recovered.db.users.items)
+        assert await user_ids(recovered.db) == ["u1", "u3", "u4"]
+        await recovered.close()
+
+    asyncio.run(run())
+
+
+def test_torn_wal_tail_is_ignored(tmp_path):
+    async def run():
+        store = open_store(tmp_path)
+        await store.db.users.insert_one({"id": "u1"})
+        await store.wal.flush()
+        crash(store)
+        segment = server.WriteAheadLog.segments(tmp_path)[-1]
+        with open(segment, "ab") as f:
+            f.write(b'{"lsn":2,"c":"users","op":"ins')
+
+        recovered = open_store(tmp_path)
+        assert await user_ids(recovered.db) == ["u1"]
+        await recovered.close()
+
+    asyncio.run(run())
+
+
+def test_snapshot_during_slow_flush_keeps_acknowledged_writes(tmp_path, monkeypatch):
+    # A group-commit flush holds the WAL lock while more writes are appended
+    # and a snapshot waits for the lock; none of those writes may end up only
+    # in a segment the snapshot deletes.
+    async def run():
+        store = open_store(tmp_path)
+        await store.db.users.insert_one({"id": "u1"})
+
+        write = server.WriteAheadLog._write
+
+        def slow_write(f, lines):
+            time.sleep(0.1)
+            write(f, lines)
+
+        monkeypatch.setattr(server.WriteAheadLog, "_write", staticmethod(slow_write))
+        first = asyncio.create_task(store.db.users.insert_one({"id": "u2"}))
+        await asyncio.sleep(0.03)  # the flush of u2 now holds the lock
+        snapshot = asyncio.create_task(store.snapshot())
+        await asyncio.sleep(0)
+        third = asyncio.create_task(store.db.users.insert_one({"id": "u3"}))
+        await asyncio.gather(first, snapshot, third)
+        monkeypatch.setattr(server.WriteAheadLog, "_write", staticmethod(write))
+        await store.db.users.insert_one({"id": "u4"})
+        expected = await user_ids(store.db)
+        await store.wal.flush()
+        crash(store)
+
+        recovered = open_store(tmp_path)
+        assert expected == ["u1", "u2", "u3", "u4"]
+        assert await user_ids(recovered.db) == expected
+        await recovered.close()
+
+    asyncio.run(run())
+
+
+def test_data_dir_is_locked_while_open(tmp_path):
+    async def run():
+        store = open_store(tmp_path)
+        await store.db.users.insert_one({"id": "u1"})
+        with pytest.raises(server.DataDirLocked):
+            open_store(tmp_path)
+        # The CLI refuses the dir too, rather than snapshotting over the live WAL
+        cli = subprocess.run([sys.executable, "catalog_cli.py", "export", "products"],
+                             cwd=Path(__file__).parent, capture_output=True, text=True,
+                             env={**os.environ, "INMEMORY_DATA_DIR": str(tmp_path)})
+        assert cli.returncode == 1 and "stop the in-memory server first" in cli.stderr
+        await store.close()
+
+        reopened = open_store(tmp_path)
+        assert await user_ids(reopened.db) == ["u1"]
+        await reopened.close()
+
+    asyncio.run(run())
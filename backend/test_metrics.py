@@ -0,0 +1,51 @@
+"""Tests for the Prometheus metrics (MetricsMiddleware, InstrumentedDB, /metrics)."""
+import server
+from conftest import running_app
+
+
+def samples(client):
+    """``{"name{labels}": value}`` for every sample /metrics exposes."""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    parsed = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            parsed[sample] = float(value)
+    return parsed
+
+
+def test_requests_are_labelled_by_route_template(api):
+    product_id = api.get("/api/products").json()[0]["id"]
+    api.get(f"/api/products/{product_id}")
+    api.get("/api/products/missing")
+    api.get("/api/no-such-route")
+    metrics = samples(api)
+
+    route = 'method="GET",route="/api/products/{product_id}"'
+    assert metrics[f'http_requests_total{{{route},status="200"}}'] == 1
+    assert metrics[f'http_requests_total{{{route},status="404"}}'] == 1
+    assert metrics[f'http_request_duration_seconds_count{{{route}}}'] == 2
+    assert metrics['http_requests_total{method="GET",route="unmatched",status="404"}'] == 1
+    # Raw paths never become label values
+    assert not any(product_id in sample or "missing" in sample for sample in metrics)
+
+    # One find_one per product lookup, counted against the request and the store
+    assert metrics[f'http_request_db_operations_sum{{{route}}}'] == 2
+    assert metrics['db_operation_duration_seconds_count{collection="products",operation="find_one"}'] == 2
+    assert metrics['db_documents_returned_total{collection="products",operation="find_one"}'] == 1
+    scanned = {sample: value for sample, value in metrics.items() if sample.startswith("db_documents_scanned")}
+    # Only the in-memory store examines documents itself
+    if server.shared_store is None:
+        assert scanned['db_documents_scanned_total{collection="products",operation="find_one"}'] == 1
+        assert scanned['db_documents_scanned_total{collection="products",operation="find"}'] > 0
+    else:
+        assert scanned == {}
+
+
+def test_metrics_can_be_disabled(tmp_path):
+    with running_app("memory", tmp_path, METRICS_ENABLED="0") as client:
+        client.get("/api/products")
+        assert not isinstance(server.db, server.InstrumentedDB)
+        assert client.get("/metrics").status_code == 404
@@ -0,0 +1,70 @@
+"""Tests for keyset-paginated product and order listings."""
+import base64
+import json
+
+import pytest
+
+
+def raw_cursor(*parts) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(parts)).encode()).decode().rstrip("=")
+
+
+def test_product_pages_follow_the_cursor(api):
+    everything = api.get("/api/products", params={"sort": "price", "limit": 100}).json()
+    pages, params = [], {"sort": "price", "limit": 3}
+    while True:
+        response = api.get("/api/products", params=params)
+        pages.extend(response.json())
+        if "x-next-cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["x-next-cursor"]
+    assert pages == everything and len(everything) == 8
+
+
+@pytest.mark.parametrize("cursor", [
+    raw_cursor("name", {"a": 1}, "x"),
+    raw_cursor("name", ["a"], "x"),
+    raw_cursor("name", True, "x"),
+    raw_cursor("name", "Lamp", 5),
+    raw_cursor("name", "Lamp", None),
+    raw_cursor("name", "Lamp"),
+    "not base64 json",
+])
+def test_malformed_product_cursor_is_a_400(api, cursor):
+    response = api.get("/api/products", params={"sort": "name", "cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_cursor_of_another_sort_is_rejected(api):
+    response = api.get("/api/products", params={"sort": "price", "cursor": raw_cursor("name", "Lamp", "x")})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cursor does not match sort order"
+
+
+def test_order_pages_follow_the_cursor(api):
+    product_id = api.get("/api/products").json()[0]["id"]
+    for _ in range(5):
+        api.post("/api/cart", json={"product_id": product_id})
+        assert api.post("/api/checkout", json={"name": "Tester", "email": "tester@example.com"}).status_code == 200
+    everything = api.get("/api/orders", params={"limit": 50}).json()
+    pages, params = [], {"limit": 2}
+    while True:
+        response = api.get("/api/orders", params=params)
+        pages.extend(response.json())
+        if "x-next-cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["x-next-cursor"]
+    assert pages == everything and len(everything) == 5
+
+
+@pytest.mark.parametrize("cursor", [
+    raw_cursor("orders", [1], "x"),
+    raw_cursor("orders", 1, "x"),
+    raw_cursor("orders", None, "x"),
+    raw_cursor("orders", "2026-03-01T00:00:00+00:00", {"id": 1}),
+])
+def test_malformed_order_cursor_is_a_400(api, cursor):
+    response = api.get("/api/orders", params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,256 @@
+"""Cross-backend tests for the query engine.
+
+The same filters, sorted cursors, keyset pages and writes run against the
+in-memory DB (plain and compact records) and the SQLite store. Each must
+agree with an unindexed InMemoryCollection, whose plain scan is the reference.
+"""
+import asyncio
+import random
+
+import pytest
+
+import server
+
+BACKENDS = ("memory", "compact", "sqlite")
+
+CATEGORIES = ("Audio", "Home", "Books", "Toys")
+NAMES = ("Lamp", "Speaker", "Novel", "Robot", "Kettle")
+PRICES = (5, 9.5, 20, 49.99, 80, 120)
+
+FILTERS = [
+    {},
+    {"category": "Audio"},
+    {"category": {"$eq": "Home"}},
+    {"category": {"$ne": "Audio"}},
+    {"category": {"$in": ["Audio", "Toys"]}},
+    {"category": {"$nin": ["Audio", "Toys"]}},
+    {"price": {"$gt": 20}},
+    {"price": {"$gte": 20, "$lt": 80}},
+    {"price": {"$lte": 9.5}},
+    {"category": "Books", "price": {"$gte": 49.99}},
+    {"id": {"$in": ["p003", "p050", "p999"]}},
+    {"stock": {"$exists": True}},
+    {"stock": {"$exists": False}},
+    {"stock": {"$gte": 5}},
+    {"$or": [{"category": "Audio"}, {"price": {"$lt": 9.5}}]},
+    {"$and": [{"price": {"$gt": 5}}, {"price": {"$lt": 120}}], "category": {"$in": ["Home", "Books"]}},
+]
+
+SORTED_QUERIES = [
+    # filter, sort, skip, limit, to_list length
+    ({}, [("name", 1), ("id", 1)], 0, 0, None),
+    ({}, [("price", -1), ("id", -1)], 0, 10, None),
+    ({}, [("price", 1), ("id", 1)], 15, 0, 7),
+    ({"category": "Audio"}, [("name", 1), ("id", 1)], 3, 5, None),
+    ({"category": "Home"}, [("price", -1), ("id", -1)], 0, 0, 4),
+    ({"price": {"$gte": 20}}, [("price", 1), ("id", 1)], 2, 9, None),
+    ({"category": {"$in": ["Toys", "Books"]}}, [("category", 1), ("price", -1), ("id", 1)], 0, 12, None),
+    ({"stock": {"$exists": True}}, [("stock", -1), ("id", 1)], 0, 0, None),
+    ({}, [("id", -1)], 100, 50, None),
+]
+
+
+def open_db(backend, tmp_path):
+    if backend == "sqlite":
+        return server.SQLiteStore(str(tmp_path / "db.sqlite"), list(server.MONGO_INDEXES))
+    return server.InMemoryDB(compact=backend == "compact")
+
+
+def close_db(db):
+    if isinstance(db, server.SQLiteStore):
+        db.close()
+
+
+def make_products(count=120, seed=7):
+    rng = random.Random(seed)
+    products = []
+    for i in range(count):
+        product = {
+            "id": f"p{i:03d}",
+            "name": f"{rng.choice(NAMES)} {i % 7}",
+            "description": "d",
+            "price": rng.choice(PRICES),
+            "category": rng.choice(CATEGORIES),
+            "image": f"https://example.com/{i}.jpg",
+        }
+        if i % 3:
+            product["stock"] = rng.randint(0, 10)
+        products.append(product)
+    return products
+
+
+def make_orders(count=60, seed=11):
+    rng = random.Random(seed)
+    orders = []
+    for i in range(count):
+        lines = [{"product_id": f"p{rng.randrange(120):03d}", "product_name": "x",
+                  "quantity": rng.randint(1, 3), "price": rng.choice(PRICES)} for _ in range(rng.randint(1, 3))]
+        orders.append({
+            "id": f"o{i:03d}",
+            "user_id": f"u{i % 4}",
+            "items": lines,
+            "total": round(sum(line["price"] * line["quantity"] for line in lines), 2),
+            "customer_name": f"Customer {i % 4}",
+            "customer_email": f"u{i % 4}@example.com",
+            "item_count": sum(line["quantity"] for line in lines),
+            # Several orders share a timestamp, so ties fall back to id
+            "created_at": f"2026-03-{1 + i // 6:02d}T10:{i % 3:02d}:00.123456+00:00",
+        })
+    return orders
+
+
+async def load(collection, docs):
+    await collection.insert_many([dict(doc) for doc in docs])
+    return collection
+
+
+async def contents(collection):
+    return sorted(await collection.find({}, {"_id": 0}).to_list(None), key=lambda d: d["id"])
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_filters_match_a_plain_scan(backend, tmp_path):
+    async def run():
+        db = open_db(backend, tmp_path)
+        products = await load(db.products, make_products())
+        reference = await load(server.InMemoryCollection(), make_products())
+        for query in FILTERS:
+            expected = sorted(await reference.find(query, {"_id": 0}).to_list(None), key=lambda d: d["id"])
+            found = sorted(await products.find(query, {"_id": 0}).to_list(None), key=lambda d: d["id"])
+            assert found == expected, query
+            assert await products.count_documents(query) == len(expected), query
+            assert (await products.find_one(query, {"_id": 0}) is None) == (not expected), query
+        # Projections build documents from the listed fields only
+        found = await products.find({"category": "Audio"}, {"_id": 0, "id": 1, "price": 1}).to_list(None)
+        assert found and all(set(doc) == {"id", "price"} for doc in found)
+        found = await products.find({}, {"_id": 0, "description": 0, "image": 0}).to_list(None)
+        assert all("description" not in doc and "image" not in doc and "name" in doc for doc in found)
+        close_db(db)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_sorted_cursors_match_a_plain_scan(backend, tmp_path):
+    async def run():
+        db = open_db(backend, tmp_path)
+        products = await load(db.products, make_products())
+        reference = await load(server.InMemoryCollection(), make_products())
+        for query, sort, skip, limit, length in SORTED_QUERIES:
+            def cursor(collection):
+                return collection.find(query, {"_id": 0}).sort(sort).skip(skip).limit(limit)
+            expected = await cursor(reference).to_list(length)
+            assert await cursor(products).to_list(length) == expected, (query, sort, skip, limit)
+            assert [doc async for doc in cursor(products)] == await cursor(reference).to_list(None)
+        close_db(db)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("sort", list(server.PRODUCT_SORTS))
+@pytest.mark.parametrize("category", [None, "Books"])
+def test_keyset_pages_follow_the_sort_order(backend, sort, category, tmp_path, monkeypatch):
+    async def run():
+        db = open_db(backend, tmp_path)
+        await load(db.products, make_products())
+        monkeypatch.setattr(server, "db", db)
+        field, descending = server.PRODUCT_SORTS[sort]
+        direction = -1 if descending else 1
+        everything = await db.products.find({"category": category} if category else {}, {"_id": 0}) \
+            .sort([(field, direction), ("id", direction)]).to_list(None)
+        pages, after = [], None
+        while True:
+            page = await server.fetch_product_page(category, sort, after, 7)
+            pages.extend(page)
+            # A cursor that fails to move past its own page would loop forever
+            assert len(pages) <= len(everything)
+            if len(page) < 7:
+                break
+            after = server.decode_cursor(sort, server.product_page_cursor(sort, page[-1]))
+        assert pages == everything
+        close_db(db)
+
+    asyncio.run(run())
+
+
+async def apply_writes(collection):
+    """Run a fixed mix of writes and return every result plus the final documents.
+
+    Single-document writes match one document only: which of several
+    matches they pick is up to the backend, as with MongoDB.
+    """
+    after = server.ReturnDocument.AFTER
+    results = [
+        tuple(await collection.update_one({"id": "p001"}, {"$set": {"price": 1.5, "tags": ["a", "b"]}})),
+        tuple(await collection.update_one({"id": "p011", "stock": {"$gte": 2}}, {"$inc": {"stock": -2}})),
+        tuple(await collection.update_one({"id": "p010", "stock": {"$gte": 2}}, {"$inc": {"stock": -2}})),
+        tuple(await collection.update_one({"id": "p002"}, {"$unset": {"stock": ""}, "$set": {"category": "Home"}})),
+        tuple(await collection.update_one({"id": "nope"}, {"$set": {"price": 1}})),
+        tuple(await collection.update_one({"id": "new-1"}, {"$set": {"name": "New", "price": 3},
+                                                            "$setOnInsert": {"category": "Toys"}}, upsert=True)),
+        await collection.find_one_and_update({"id": "p004"}, {"$inc": {"price": 10}}, {"_id": 0, "id": 1, "price": 1}),
+        await collection.find_one_and_update({"id": "p005"}, {"$set": {"name": "Renamed"}}, {"_id": 0},
+                                             return_document=after),
+        await collection.find_one_and_update({"id": "new-2"}, {"$inc": {"stock": 4},
+                                                               "$set": {"name": "Two", "price": 6, "category": "Home"}},
+                                             {"_id": 0}, upsert=True, return_document=after),
+        tuple(await collection.bulk_write([
+            server.UpdateOne({"id": "p006"}, {"$set": {"price": 7}}, upsert=True),
+            server.UpdateOne({"id": "new-3"}, {"$setOnInsert": {"name": "Bulk", "price": 2, "category": "Books"}},
+                             upsert=True),
+            server.UpdateOne({"id": "p007"}, {"$setOnInsert": {"name": "Ignored"}}, upsert=True),
+            server.UpdateOne({"id": "nope"}, {"$set": {"price": 1}}),
+        ], ordered=False)),
+        tuple(await collection.delete_one({"id": {"$in": ["p010", "p999"]}, "price": {"$gt": 0}})),
+        tuple(await collection.delete_many({"price": {"$lt": 9.5}})),
+        tuple(await collection.delete_many({"id": "nope"})),
+    ]
+    return results, await contents(collection)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_writes_match_a_plain_scan(backend, tmp_path):
+    async def run():
+        db = open_db(backend, tmp_path)
+        products = await load(db.products, make_products())
+        reference = await load(server.InMemoryCollection(), make_products())
+        expected = await apply_writes(reference)
+        assert await apply_writes(products) == expected
+        # Indexes follow the writes: indexed lookups and sorts see the new values
+        for query, sort, skip, limit, length in SORTED_QUERIES:
+            assert (await products.find(query, {"_id": 0}).sort(sort).to_list(None)
+                    == await reference.find(query, {"_id": 0}).sort(sort).to_list(None)), query
+        close_db(db)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_orders_round_trip_and_page_by_timestamp(backend, tmp_path):
+    # Compact records store timestamps as integers and pack order lines;
+    # queries still take and return the ISO strings
+    async def run():
+        db = open_db(backend, tmp_path)
+        orders = await load(db.orders, make_orders())
+        reference = await load(server.InMemoryCollection(), make_orders())
+        assert await contents(orders) == await contents(reference)
+        newest_first = [("created_at", -1), ("id", -1)]
+        queries = [
+            {"user_id": "u1"},
+            {"user_id": "u2", "created_at": {"$lt": "2026-03-05T10:01:00.123456+00:00"}},
+            {"user_id": "u3", "$or": [{"created_at": {"$lt": "2026-03-04T10:00:00.123456+00:00"}},
+                                      {"created_at": "2026-03-04T10:00:00.123456+00:00", "id": {"$lt": "o027"}}]},
+            {"created_at": {"$gte": "2026-03-03", "$lte": "2026-03-06"}},
+        ]
+        for query in queries:
+            for projection in ({"_id": 0}, {"_id": 0, "items": 0}, {"_id": 0, "id": 1, "created_at": 1}):
+                expected = await reference.find(query, projection).sort(newest_first).limit(5).to_list(None)
+                assert await orders.find(query, projection).sort(newest_first).limit(5).to_list(None) == expected
+        await orders.update_one({"id": "o010"}, {"$set": {"created_at": "2026-04-01T00:00:00+00:00"}})
+        await reference.update_one({"id": "o010"}, {"$set": {"created_at": "2026-04-01T00:00:00+00:00"}})
+        assert (await orders.find({"user_id": "u2"}, {"_id": 0}).sort(newest_first).to_list(3)
+                == await reference.find({"user_id": "u2"}, {"_id": 0}).sort(newest_first).to_list(3))
+        close_db(db)
+
+    asyncio.run(run())
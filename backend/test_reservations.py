@@ -0,0 +1,128 @@
+"""Tests for stock reservations at checkout, on the in-memory and SQLite stores."""
+import asyncio
+import time
+
+import pytest
+
+import server
+from conftest import admin_headers, running_app
+
+BACKENDS = ("memory", "sqlite")
+
+
+def stocked_products(client, *levels):
+    """Give catalog products these stock levels; return their ids.
+
+    The ids are in the order lines are reserved in, so a short line given
+    last fails after the earlier lines were taken.
+    """
+    headers = admin_headers(client)
+    ids = sorted(p["id"] for p in client.get("/api/products").json()[:len(levels)])
+    for product_id, stock in zip(ids, levels):
+        response = client.put(f"/api/admin/products/{product_id}/stock", json={"stock": stock}, headers=headers)
+        assert response.status_code == 200, response.text
+    return ids
+
+
+def stock(client, product_id):
+    return client.get(f"/api/products/{product_id}/stock").json()["stock"]
+
+
+def add(client, product_id, quantity):
+    response = client.post("/api/cart", json={"product_id": product_id, "quantity": quantity})
+    assert response.status_code == 200, response.text
+    return response.json()["cart_item_id"]
+
+
+def checkout(client, reservation_id=None):
+    return client.post("/api/checkout", json={"name": "Tester", "email": "tester@example.com",
+                                              "reservation_id": reservation_id})
+
+
+def test_short_line_takes_nothing(api):
+    plenty, scarce = stocked_products(api, 5, 1)
+    add(api, plenty, 2)
+    add(api, scarce, 2)
+    for attempt in (lambda: api.post("/api/checkout/reserve"), lambda: checkout(api)):
+        response = attempt()
+        assert response.status_code == 409
+        assert response.json()["detail"].startswith("Not enough stock for ")
+        assert (stock(api, plenty), stock(api, scarce)) == (5, 1)
+    assert len(api.get("/api/cart").json()["items"]) == 2
+    assert api.get("/api/orders").json() == []
+
+
+def test_checkout_uses_a_reservation_once(api):
+    tracked, untracked = stocked_products(api, 5, None)
+    add(api, tracked, 2)
+    add(api, untracked, 1)
+    reservation = api.post("/api/checkout/reserve").json()
+    assert stock(api, tracked) == 3
+
+    first = checkout(api, reservation["reservation_id"])
+    assert first.status_code == 200, first.text
+    assert first.json()["total"] == reservation["total"]
+    second = checkout(api, reservation["reservation_id"])
+    assert second.status_code == 409
+    assert (stock(api, tracked), stock(api, untracked)) == (3, None)
+    assert len(api.get("/api/orders").json()) == 1
+    assert api.get("/api/cart").json()["items"] == []
+
+
+def test_new_reservation_replaces_the_old_one(api):
+    (product,) = stocked_products(api, 5)
+    add(api, product, 2)
+    old = api.post("/api/checkout/reserve").json()
+    add(api, product, 1)
+    new = api.post("/api/checkout/reserve").json()
+    assert stock(api, product) == 2
+    assert checkout(api, old["reservation_id"]).status_code == 409
+    assert checkout(api, new["reservation_id"]).status_code == 200
+    assert stock(api, product) == 2
+
+
+def test_lines_added_after_the_reservation_stay_in_the_cart(api):
+    first, second = stocked_products(api, 10, None)
+    line = add(api, first, 2)
+    reservation = api.post("/api/checkout/reserve").json()
+    add(api, first, 1)
+    other = add(api, second, 1)
+    assert checkout(api, reservation["reservation_id"]).status_code == 200
+    cart = api.get("/api/cart").json()
+    assert {item["id"]: item["quantity"] for item in cart["items"]} == {line: 1, other: 1}
+    assert stock(api, first) == 8
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_expired_reservations_give_their_stock_back(backend, tmp_path):
+    env = {"RESERVATION_TTL_SECONDS": "0", "RESERVATION_SWEEP_INTERVAL": "0.02"}
+    with running_app(backend, tmp_path, **env) as client:
+        (product,) = stocked_products(client, 4)
+        add(client, product, 3)
+        reservation = client.post("/api/checkout/reserve").json()
+        assert checkout(client, reservation["reservation_id"]).status_code == 409
+        deadline = time.monotonic() + 5
+        while stock(client, product) != 4 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert stock(client, product) == 4
+        # The cart is untouched: checking out without a reservation still works
+        assert checkout(client).status_code == 200
+        assert stock(client, product) == 1
+
+
+def test_concurrent_reservations_never_oversell(api):
+    a, b = stocked_products(api, 10, 3)
+
+    async def reserve_many():
+        async def attempt():
+            try:
+                await server.reserve_stock({a: 1, b: 1})
+            except server.OutOfStock:
+                return False
+            return True
+        return await asyncio.gather(*(attempt() for _ in range(8)))
+
+    results = api.portal.call(reserve_many)
+    # Each reservation took both lines or neither
+    assert results.count(True) == 3
+    assert (stock(api, a), stock(api, b)) == (7, 0)
@@ -0,0 +1,136 @@
+"""Tests for product search and autocomplete (ProductSearchIndex)."""
+import json
+import random
+
+import server
+from conftest import admin_headers
+
+
+def product(product_id, name, description="", category="Home"):
+    return {"id": product_id, "name": name, "description": description, "price": 10,
+            "category": category, "image": f"https://example.com/{product_id}.jpg"}
+
+
+def make_index(*products):
+    index = server.ProductSearchIndex()
+    index.vocabulary = None
+    for doc in products:
+        index.add(doc)
+    index.finish()
+    return index
+
+
+def ids(results):
+    return [doc["id"] for doc in results[0]]
+
+
+def test_ranking_prefers_name_matches_and_rarer_terms():
+    index = make_index(
+        product("in-name", "Kettle", "boils water"),
+        product("in-description", "Cooker", "a kettle for the stove"),
+        product("long-name", "Kettle stand with extra long name for tea lovers"),
+        product("speaker", "Speaker", "portable water resistant", category="Audio"),
+        product("bottle", "Water bottle", "steel", category="Sports"),
+    )
+    # Name matches weigh more; a longer document scores lower for the same match
+    assert ids(index.search("kettle")) == ["in-name", "long-name", "in-description"]
+    # Every query term contributes: "water kettle" puts the product with both first
+    assert ids(index.search("water kettle"))[0] == "in-name"
+    results, total, facets = index.search("water")
+    assert total == 3 and facets == {"Home": 1, "Audio": 1, "Sports": 1}
+    assert ids(index.search("water", category="Sports")) == ["bottle"]
+    # The last term completes as a prefix while it is being typed
+    assert ids(index.search("kett"))[0] == "in-name"
+    assert index.search("kett ")[1] == 0
+    assert index.search("the of") == ([], 0, {})
+
+
+def test_pruned_results_match_scoring_every_match(monkeypatch):
+    rng = random.Random(5)
+    words = "wireless smart speaker watch lamp leather leash steel mug cable".split()
+
+    def random_product(i):
+        return product(f"p{i:03d}", " ".join(rng.sample(words, 2)), " ".join(rng.sample(words, 3)),
+                       category=rng.choice(["Home", "Audio", "Sports"]))
+
+    # "lam" expands to a common and a rare term, which weigh differently
+    rare = [product(f"r{i}", "Lampshade", "linen") for i in range(3)]
+    index = make_index(*rare, *(random_product(i) for i in range(300)))
+    queries = ["wireless", "smart watch", "wireless speaker lea", "steel mug cable lamp", "lam"]
+
+    def check():
+        for query in queries:
+            for category in (None, "Audio"):
+                for limit in (1, 5, 50):
+                    pruned = index.search(query, category, limit)
+                    monkeypatch.setattr(server.ProductSearchIndex, "MAX_PRUNED_POSITIONS", 0)
+                    full = index.search(query, category, limit)
+                    monkeypatch.undo()
+                    assert (ids(pruned), pruned[1:]) == (ids(full), full[1:]), (query, category, limit)
+
+    check()
+    # Updates keep the score-ordered postings of searched terms in step
+    for i in range(0, 300, 7):
+        index.add(random_product(i))
+        index.remove(f"p{i + 3:03d}")
+    check()
+
+
+def test_autocomplete_lists_the_most_common_completions_first():
+    index = make_index(
+        product("a", "Steel bottle"), product("b", "Steel mug"), product("c", "Stereo speaker"),
+        product("d", "Stew pot", "steel"),
+    )
+    assert index.complete("ste", 10) == ["steel", "stereo", "stew"]
+    assert index.complete("ste", 1) == ["steel"]
+    assert index.complete("x", 5) == []
+
+
+def test_imports_update_the_index_in_place(api, monkeypatch):
+    catalog = api.get("/api/products").json()
+    assert api.get("/api/products/search", params={"q": "wireless"}).json()["total"] > 0
+
+    def no_rebuild():
+        raise AssertionError("import rebuilt the whole search index")
+
+    monkeypatch.setattr(server, "rebuild_search_index", no_rebuild)
+    changed = dict(next(p for p in catalog if p["name"] == "Wireless Headphones"),
+                   name="Studio Headphones", description="Wired monitor headphones")
+    added = product("imported-1", "Bamboo Cutting Board", "Sturdy bamboo board", category="Kitchen")
+    body = "\n".join(json.dumps(doc) for doc in (changed, added)) + "\n"
+    response = api.post("/api/admin/products/import", content=body, headers=admin_headers(api))
+    assert response.json()["inserted"] == 1 and response.json()["updated"] == 1
+
+    def search(q):
+        return api.get("/api/products/search", params={"q": q}).json()
+
+    found = search("bamboo")
+    assert [item["id"] for item in found["items"]] == ["imported-1"] and found["facets"] == {"Kitchen": 1}
+    assert [item["id"] for item in search("studio headphones")["items"]][0] == changed["id"]
+    # Terms only the old version had are gone
+    assert changed["id"] not in [item["id"] for item in search("noise cancellation")["items"]]
+    assert "bamboo" in api.get("/api/products/autocomplete", params={"q": "bam"}).json()["suggestions"]
+
+    # Same state as an index built from scratch
+    rebuilt = api.portal.call(server.ProductSearchIndex.load)
+    assert rebuilt.postings == server.search_index.postings
+    assert rebuilt.vocabulary == server.search_index.vocabulary
+
+
+def test_writes_before_the_first_search_leave_the_index_unbuilt(api, monkeypatch):
+    monkeypatch.setattr(server, "search_index", server.ProductSearchIndex())
+    rebuild = server.rebuild_search_index
+
+    def no_rebuild():
+        raise AssertionError("a write rebuilt the unbuilt search index")
+
+    monkeypatch.setattr(server, "rebuild_search_index", no_rebuild)
+    added = product("imported-1", "Bamboo Cutting Board", "Sturdy bamboo board", category="Kitchen")
+    response = api.post("/api/admin/products/import", content=json.dumps(added) + "\n",
+                        headers=admin_headers(api))
+    assert response.json()["inserted"] == 1
+    assert not server.search_index.built
+
+    monkeypatch.setattr(server, "rebuild_search_index", rebuild)
+    found = api.get("/api/products/search", params={"q": "bamboo"}).json()
+    assert [item["id"] for item in found["items"]] == ["imported-1"]
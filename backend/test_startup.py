@@ -0,0 +1,57 @@
+"""Tests for cold start: FAST_START's background warm-up and /health's StartupReport."""
+import threading
+import time
+
+from conftest import running_app
+
+FOREGROUND = ["imports", "store", "app", "server"]
+WARM_UP = ["seed", "demo_user", "catalog_cache", "password_hashing"]
+
+
+def phases(report, background):
+    return [phase["name"] for phase in report["phases"] if phase["background"] == background]
+
+
+def test_fast_start_serves_before_warm_up_finishes(tmp_path):
+    release = threading.Event()
+
+    def hold_seeding(server):
+        seed_products = server.seed_products
+
+        async def held_seed_products():
+            await server.asyncio.get_running_loop().run_in_executor(None, release.wait, 10)
+            await seed_products()
+
+        server.seed_products = held_seed_products
+
+    with running_app("memory", tmp_path, before_start=hold_seeding, FAST_START="1") as client:
+        try:
+            health = client.get("/health").json()
+            assert health["status"] == "ok" and not health["warm"]
+            report = health["startup"]
+            assert report["fast_start"] and report["ready_seconds"] > 0 and report["warm_seconds"] is None
+            assert phases(report, False) == FOREGROUND and phases(report, True) == []
+            # Requests work while the catalog is still being seeded
+            assert client.get("/api/products").status_code == 200
+            assert client.get("/api/cart").json() == {"items": [], "total": 0.0}
+        finally:
+            release.set()
+
+        deadline = time.monotonic() + 5
+        health = client.get("/health").json()
+        while not health["warm"]:
+            assert time.monotonic() < deadline, health
+            time.sleep(0.01)
+            health = client.get("/health").json()
+        report = health["startup"]
+        assert phases(report, False) == FOREGROUND and phases(report, True) == WARM_UP
+        assert report["warm_seconds"] >= report["ready_seconds"]
+        assert len(client.get("/api/products").json()) == 8
+
+
+def test_default_start_is_ready_only_after_preparing_the_store(tmp_path):
+    with running_app("memory", tmp_path) as client:
+        report = client.get("/health").json()["startup"]
+        assert not report["fast_start"]
+        assert phases(report, False) == FOREGROUND + ["seed", "demo_user"]
+        assert phases(report, True) == []
@@ -35,13 +35,19 @@ export const CartProvider = ({ children }) => {
       const response = await axios.get(`${API}/cart`, {
         headers: getAuthHeader()
       });
-      setCart(response.data);
-      setCartCount(response.data.items.reduce((sum, item) => sum + item.quantity, 0));
+      applyCart(response.data);
     } catch (error) {
       console.error('Failed to fetch cart:', error);
     }
   };
 
+  // Cart mutations are sent with ?include=cart so the response carries the
+  // updated cart and no follow-up GET /cart is needed.
+  const applyCart = (nextCart) => {
+    setCart(nextCart);
+    setCartCount(nextCart.items.reduce((sum, item) => sum + item.quantity, 0));
+  };
+
   useEffect(() => {
     if (user) {
       fetchCart();
@@ -53,11 +59,11 @@ export const CartProvider = ({ children }) => {
 
   const addToCart = async (productId, quantity = 1) => {
     try {
-      await axios.post(`${API}/cart`, 
+      const response = await axios.post(`${API}/cart`,
         { product_id: productId, quantity },
-        { headers: getAuthHeader() }
+        { headers: getAuthHeader(), params: { include: 'cart' } }
       );
-      await fetchCart();
+      applyCart(response.data.cart);
       toast.success('Added to cart!');
     } catch (error) {
       console.error('Failed to add to cart:', error);
@@ -65,13 +71,29 @@ export const CartProvider = ({ children }) => {
     }
   };
 
+  // Apply many line changes ({ op: 'add' | 'update' | 'remove', ... }) in one request
+  const batchUpdateCart = async (operations) => {
+    try {
+      const response = await axios.post(`${API}/cart/batch`,
+        { operations },
+        { headers: getAuthHeader() }
+      );
+      applyCart(response.data.cart);
+      return response.data.results;
+    } catch (error) {
+      console.error('Failed to update cart:', error);
+      toast.error('Failed to update cart');
+      return null;
+    }
+  };
+
   const updateCartItem = async (cartItemId, quantity) => {
     try {
-      await axios.patch(`${API}/cart/${cartItemId}`,
+      const response = await axios.patch(`${API}/cart/${cartItemId}`,
         { quantity },
-        { headers: getAuthHeader() }
+        { headers: getAuthHeader(), params: { include: 'cart' } }
       );
-      await fetchCart();
+      applyCart(response.data.cart);
     } catch (error) {
       console.error('Failed to update cart item:', error);
       toast.error('Failed to update cart');
@@ -80,10 +102,11 @@ export const CartProvider = ({ children }) => {
 
   const removeFromCart = async (cartItemId) => {
     try {
-      await axios.delete(`${API}/cart/${cartItemId}`, {
-        headers: getAuthHeader()
+      const response = await axios.delete(`${API}/cart/${cartItemId}`, {
+        headers: getAuthHeader(),
+        params: { include: 'cart' }
       });
-      await fetchCart();
+      applyCart(response.data.cart);
       toast.success('Removed from cart');
     } catch (error) {
       console.error('Failed to remove from cart:', error);
@@ -92,7 +115,7 @@ export const CartProvider = ({ children }) => {
   };
 
   return (
-    <CartContext.Provider value={{ cart, cartCount, addToCart, updateCartItem, removeFromCart, fetchCart }}>
+    <CartContext.Provider value={{ cart, cartCount, addToCart, updateCartItem, removeFromCart, batchUpdateCart, fetchCart }}>
       {children}
     </CartContext.Provider>
   );
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import Navbar from '@/components/Navbar';
 import ProductCard from '@/components/ProductCard';
+import { Button } from '@/components/ui/button';
 
 // Resolve backend URL with a safe development fallback.
 const getBackendUrl = () => {
@@ -25,12 +26,16 @@ const API = `${BACKEND_URL}/api`;
 const ProductsPage = () => {
   const [products, setProducts] = useState([]);
   const [loading, setLoading] = useState(true);
+  // Cursor of the next catalog page (X-Next-Cursor), null on the last page
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     const fetchProducts = async () => {
       try {
         const response = await axios.get(`${API}/products`);
         setProducts(response.data);
+        setNextCursor(response.headers['x-next-cursor'] || null);
       } catch (error) {
         console.error('Failed to fetch products:', error);
       } finally {
@@ -41,6 +46,19 @@ const ProductsPage = () => {
     fetchProducts();
   }, []);
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/products`, { params: { cursor: nextCursor } });
+      setProducts((current) => [...current, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Failed to fetch products:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   return (
     <div className="min-h-screen bg-gray-50">
       <Navbar />
@@ -67,6 +85,19 @@ const ProductsPage = () => {
             ))}
           </div>
         )}
+
+        {!loading && nextCursor && (
+          <div className="text-center mt-12">
+            <Button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="bg-[#2d2d2d] hover:bg-[#1a1a1a] text-white rounded-full px-8"
+              data-testid="load-more-products-button"
+            >
+              {loadingMore ? 'Loading...' : 'Load More'}
+            </Button>
+          </div>
+        )}
       </main>
     </div>
   );